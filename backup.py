@@ -0,0 +1,125 @@
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+
+def read_backup_settings(settings_file='settings.xml'):
+    settings = {'path': None, 'interval_minutes': 60, 'keep': 5, 'pages': 256}
+    try:
+        root = ET.parse(settings_file).getroot()
+    except (FileNotFoundError, ET.ParseError):
+        logging.warning("Could not read backup settings, using defaults.")
+        return settings
+
+    backup = root.find('backup')
+    if backup is None:
+        return settings
+    for key in settings:
+        element = backup.find(key)
+        if element is None or not (element.text or '').strip():
+            continue
+        value = element.text.strip()
+        try:
+            settings[key] = value if key == 'path' else int(value)
+        except ValueError:
+            logging.warning(f"Invalid backup setting {key}: {value}")
+    return settings
+
+
+class BackupManager:
+    def __init__(self, db_manager, backup_folder=None, interval_minutes=60, keep=5, pages=256, step_sleep=0.05):
+        self.db_manager = db_manager
+        self.backup_folder = backup_folder or os.path.join(db_manager.db_folder, 'Backups')
+        self.interval = max(1, interval_minutes) * 60
+        self.keep = max(1, keep)
+        self.pages = max(1, pages)
+        self.step_sleep = step_sleep
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="BackupManager", daemon=True)
+        self.thread.start()
+        logging.info(f"Backups scheduled every {self.interval // 60} minutes into {self.backup_folder}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        # First snapshot right away, short sessions would otherwise never get one
+        self.run_backups()
+        while not self.stop_event.wait(self.interval):
+            self.run_backups()
+
+    def run_backups(self):
+        snapshots = []
+        for db_name in self.db_manager.databases:
+            try:
+                snapshot = self.backup_database(db_name)
+            except (sqlite3.Error, OSError) as e:
+                # A full disk or an offline share must not end the backup thread
+                logging.error(f"Backup of {db_name} failed: {str(e)}")
+                continue
+            if snapshot:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def backup_database(self, db_name):
+        base_name = os.path.splitext(db_name)[0]
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        snapshot = os.path.join(self.backup_folder, f"{base_name}_{stamp}.db")
+        partial = snapshot + '.part'
+        os.makedirs(self.backup_folder, exist_ok=True)
+        if os.path.exists(partial):
+            os.remove(partial)
+
+        # Own connections so the copy never touches the ones the UI is using;
+        # the page steps let writers in between batches.
+        source = sqlite3.connect(os.path.join(self.db_manager.db_folder, db_name))
+        target = sqlite3.connect(partial)
+        try:
+            source.backup(target, pages=self.pages, progress=self.log_progress, sleep=self.step_sleep)
+        finally:
+            target.close()
+            source.close()
+
+        if not self.verify_snapshot(partial):
+            logging.error(f"Backup of {db_name} failed quick_check, discarding {partial}")
+            os.remove(partial)
+            return None
+
+        os.replace(partial, snapshot)
+        logging.info(f"Backed up {db_name} to {snapshot}")
+        self.rotate_snapshots(base_name)
+        return snapshot
+
+    def log_progress(self, status, remaining, total):
+        logging.debug(f"Backup progress: {total - remaining}/{total} pages")
+
+    def verify_snapshot(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"quick_check failed on {path}: {str(e)}")
+            return False
+        finally:
+            conn.close()
+        return result == [('ok',)]
+
+    def rotate_snapshots(self, base_name):
+        pattern = os.path.join(glob.escape(self.backup_folder), f"{glob.escape(base_name)}_*.db")
+        snapshots = sorted(glob.glob(pattern))
+        for old_snapshot in snapshots[:-self.keep]:
+            logging.info(f"Removing old backup {old_snapshot}")
+            os.remove(old_snapshot)
@@ -1,16 +1,84 @@
 import sqlite3
 import os
 import logging
+import threading
+import functools
 import xml.etree.ElementTree as ET
-from PyQt5.QtWidgets import QMessageBox
 import sys
+import heapq
+import time
+from datetime import datetime, timedelta, timezone
+from sync import initialize_change_log, record_change, UPSERT, DELETE
+from prefix_index import PrefixIndex
+from schema import migrate_codes_database, VIEW_BASE_TABLES
+from membership import BloomFilter, load_bloom_filter
+
+
+def synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def chunked(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class ChangeEvent:
+    INSERTED = 'inserted'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
+    def __init__(self, db_name, table_name, action, row_ids, previous_rows=None):
+        self.db_name = db_name
+        self.table_name = table_name
+        self.action = action
+        self.row_ids = list(row_ids)
+        self.previous_rows = previous_rows or {}
+
+    def __repr__(self):
+        return f"ChangeEvent({self.db_name}, {self.table_name}, {self.action}, {self.row_ids})"
 
 
 class DatabaseManager:
-    def __init__(self):
+    default_registry = {'clients': 'Clients.db', 'codes': 'Codes.db', 'archive': 'CodesArchive.db'}
+
+    def __init__(self, error_handler=None):
+        self.error_handler = error_handler
+        self.lock = threading.RLock()
         self.db_folder = self.ensure_db_directory_exists()
-        self.databases = self.load_database_names()
+        self.registry = self.load_database_registry()
+        self.databases = list(self.registry.values())
+        self.codes_db = self.registry['codes']
+        self.archive_db = self.registry.get('archive')
+        self.replicated_databases = [self.codes_db]
+        self.view_cache = {}
+        self.logged_tables = [(self.codes_db, 'product_codes')]
+        self.archive_after_days = self.read_archive_settings()
         self.connections = self.initialize_databases()
+        self.replica_enabled, self.replica_max_bytes = self.read_replica_settings()
+        self.replica_versions = {}
+        self.replica_loaded_at = {}
+        self.replica_reload_seconds = 30
+        self.replicas = self.initialize_replicas()
+        self.change_listeners = []
+        self.name_index = PrefixIndex(self.fetch_product_names())
+        self.add_change_listener(self.update_name_index)
+        self.code_filter_path = os.path.join(self.db_folder, self.codes_db + '.bloom')
+        self.code_filter_state = self.capture_code_filter_state()
+        self.code_filter = load_bloom_filter(self.code_filter_path,
+                                             self.code_filter_fingerprint(self.code_filter_state[1]))
+        self.code_filter_stats = {'skipped': 0, 'checked': 0, 'false_positives': 0}
+        self.add_change_listener(self.update_code_filter)
+
+    def report_error(self, title, message):
+        logging.error(f"{title}: {message}")
+        if self.error_handler is not None:
+            self.error_handler(title, message)
 
     def read_db_path_from_settings(self):
         try:
@@ -18,11 +86,39 @@ class DatabaseManager:
             root = tree.getroot()
             return root.find('database/path').text
         except (ET.ParseError, AttributeError):
-            QMessageBox.critical(None, "Error", "Error parsing settings.xml or missing database path.")
+            self.report_error("Error", "Error parsing settings.xml or missing database path.")
             sys.exit(1)
 
-    def load_database_names(self):
-        return ['Clients.db', 'Codes.db']
+    def read_replica_settings(self):
+        try:
+            root = ET.parse('settings.xml').getroot()
+        except (FileNotFoundError, ET.ParseError):
+            return False, 0
+        enabled = root.findtext('database/replica/enabled', 'false').strip().lower() == 'true'
+        try:
+            max_size_mb = int(root.findtext('database/replica/max_size_mb', '256'))
+        except ValueError:
+            max_size_mb = 256
+        return enabled, max_size_mb * 1024 * 1024
+
+    def read_archive_settings(self):
+        try:
+            root = ET.parse('settings.xml').getroot()
+            return int(root.findtext('database/archive/after_days', '90'))
+        except (FileNotFoundError, ET.ParseError, ValueError):
+            return 90
+
+    def load_database_registry(self):
+        registry = dict(self.default_registry)
+        try:
+            root = ET.parse('settings.xml').getroot()
+        except (FileNotFoundError, ET.ParseError):
+            return registry
+        for element in root.findall('database/files/file'):
+            role = element.get('role')
+            if role and (element.text or '').strip():
+                registry[role] = element.text.strip()
+        return registry
 
     def ensure_db_directory_exists(self):
         db_directory = self.read_db_path_from_settings()
@@ -34,40 +130,176 @@ class DatabaseManager:
         for db_name in self.databases:
             db_path = os.path.join(self.db_folder, db_name)
             try:
-                conn = sqlite3.connect(db_path)
+                conn = sqlite3.connect(db_path, check_same_thread=False)
+                # WAL lets the backup thread read a snapshot without blocking writes
+                conn.execute("PRAGMA journal_mode=WAL")
                 self.initialize_tables(conn, db_name)
                 connections[db_name] = conn
             except sqlite3.Error as e:
-                QMessageBox.critical(None, f"Database Error ({db_name})", str(e))
+                self.report_error(f"Database Error ({db_name})", str(e))
                 sys.exit(1)
         return connections
 
     def initialize_tables(self, conn, db_name):
         cursor = conn.cursor()
-        if db_name == 'Clients.db':
+        role = next(role for role, name in self.registry.items() if name == db_name)
+        if role == 'clients':
             cursor.execute('''CREATE TABLE IF NOT EXISTS clients
                               (id INTEGER PRIMARY KEY, client_id INTEGER, client_name TEXT,
                                client_address1 TEXT, client_address2 TEXT,
                                client_phone TEXT, client_emailfax TEXT)''')
-        elif db_name == 'Codes.db':
-            cursor.execute('''CREATE TABLE IF NOT EXISTS product_codes
+        elif role == 'codes':
+            migrate_codes_database(conn, os.path.join(self.db_folder, db_name))
+            self.origin_id = initialize_change_log(conn)
+        elif role == 'archive':
+            cursor.execute('''CREATE TABLE IF NOT EXISTS archived_codes
                               (id INTEGER PRIMARY KEY, product_name TEXT, product_code TEXT,
-                               code_type TEXT, used_status TEXT)''')
+                               code_type TEXT, used_status TEXT, used_at TEXT, archived_at TEXT)''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_archived_codes_product_code
+                              ON archived_codes (product_code)''')
+            conn.commit()
+
+    def inserted_row_id(self, conn, table_name, cursor, data):
+        # An explicit id, such as a code restored from the archive, is the row; the sequence only has the highest
+        if data.get('id') is not None:
+            return data['id']
+        # Inserts through a view's trigger leave lastrowid untouched
+        base_table = VIEW_BASE_TABLES.get(table_name)
+        if base_table is None or not self.is_view(conn, table_name):
+            return cursor.lastrowid
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (base_table,)).fetchone()
+        return row[0] if row else None
+
+    def is_view(self, conn, table_name):
+        # Checked once per connection and table, bulk imports ask for every row
+        key = (conn, table_name)
+        if key not in self.view_cache:
+            row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+            self.view_cache[key] = row is not None and row[0] == 'view'
+        return self.view_cache[key]
+
+    def database_size(self, conn):
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    def initialize_replicas(self):
+        replicas = {}
+        if not self.replica_enabled:
+            return replicas
+        for db_name in self.replicated_databases:
+            if db_name not in self.connections:
+                continue
+            replica = self.load_replica(db_name)
+            if replica is not None:
+                replicas[db_name] = replica
+        return replicas
+
+    def load_replica(self, db_name):
+        conn = self.connections[db_name]
+        size = self.database_size(conn)
+        if size > self.replica_max_bytes:
+            logging.info(f"{db_name} is {size} bytes, above the replica limit, reading from disk")
+            return None
+        replica = sqlite3.connect(':memory:', check_same_thread=False)
+        try:
+            # Taken before the copy, a commit racing it only causes one extra reload
+            self.replica_versions[db_name] = self.data_version(conn)
+            self.replica_loaded_at[db_name] = time.monotonic()
+            conn.backup(replica)
+        except sqlite3.Error as e:
+            logging.error(f"Could not load in-memory replica of {db_name}: {str(e)}")
+            replica.close()
+            return None
+        logging.info(f"Loaded in-memory replica of {db_name} ({self.database_size(replica)} bytes)")
+        return replica
 
+    @synchronized
+    def refresh_replica(self, db_name):
+        self.drop_replica(db_name)
+        replica = self.load_replica(db_name)
+        if replica is not None:
+            self.replicas[db_name] = replica
+
+    def data_version(self, conn):
+        # Changes whenever another connection commits, never for this connection's own writes
+        return conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def current_replica(self, db_name):
+        replica = self.replicas.get(db_name)
+        if replica is None:
+            return None
+        if self.data_version(self.connections[db_name]) != self.replica_versions.get(db_name):
+            # While outside writes keep coming, read from disk instead of copying the file on every read
+            if time.monotonic() - self.replica_loaded_at.get(db_name, 0) < self.replica_reload_seconds:
+                return None
+            logging.info(f"{db_name} was written by another connection, reloading its replica")
+            self.refresh_replica(db_name)
+            replica = self.replicas.get(db_name)
+        return replica
+
+    def drop_replica(self, db_name):
+        replica = self.replicas.pop(db_name, None)
+        if replica is not None:
+            replica.close()
+
+    @synchronized
+    def replica_memory_usage(self):
+        return {db_name: self.database_size(replica) for db_name, replica in self.replicas.items()}
+
+    def apply_to_replica(self, db_name, table_name, action, row_ids):
+        replica = self.replicas.get(db_name)
+        if replica is None or not row_ids:
+            return
+        try:
+            for chunk in chunked(row_ids):
+                placeholders = ', '.join(['?' for _ in chunk])
+                replica.execute(f"DELETE FROM {table_name} WHERE id IN ({placeholders})", chunk)
+                if action == ChangeEvent.DELETED:
+                    continue
+                cursor = self.connections[db_name].execute(
+                    f"SELECT * FROM {table_name} WHERE id IN ({placeholders})", chunk)
+                columns = ', '.join(column[0] for column in cursor.description)
+                values = ', '.join(['?' for _ in cursor.description])
+                replica.executemany(f"INSERT INTO {table_name} ({columns}) VALUES ({values})", cursor.fetchall())
+            replica.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Replica of {db_name} out of sync, reading from disk: {str(e)}")
+            self.drop_replica(db_name)
+            return
+        if action == ChangeEvent.INSERTED and self.database_size(replica) > self.replica_max_bytes:
+            logging.info(f"Replica of {db_name} grew past the limit, reading from disk")
+            self.drop_replica(db_name)
+
+    @synchronized
     def fetch_data(self, db_name, query, params=None):
         if db_name in self.connections:
-            conn = self.connections[db_name]
             try:
+                conn = self.current_replica(db_name) or self.connections[db_name]
                 cursor = conn.cursor()
                 cursor.execute(query, params or ())
                 return cursor.fetchall()
             except sqlite3.Error as e:
-                QMessageBox.critical(None, f"Database Error ({db_name})", f"Error fetching data: {str(e)}")
+                self.report_error(f"Database Error ({db_name})", f"Error fetching data: {str(e)}")
         else:
-            QMessageBox.critical(None, "Database Error", f"Database {db_name} not found.")
+            self.report_error("Database Error", f"Database {db_name} not found.")
         return []
 
+    @synchronized
     def execute_query(self, db_name, query, params=None):
+        if self.execute_write(db_name, query, params) is None:
+            return False
+        # Raw statements may change the schema too
+        self.view_cache = {}
+        # Arbitrary statements can touch any row, so reload the whole replica
+        if db_name in self.replicas:
+            self.refresh_replica(db_name)
+        if db_name == self.codes_db:
+            self.name_index.build(self.fetch_product_names())
+            self.code_filter = None
+        return True
+
+    def execute_write(self, db_name, query, params=None, before_commit=None):
         if db_name in self.connections:
             conn = self.connections[db_name]
             try:
@@ -75,28 +307,472 @@ class DatabaseManager:
                 logging.info(f"Executing query: {query}")
                 logging.info(f"Parameters: {params}")
                 cursor.execute(query, params or ())
+                if before_commit is not None:
+                    before_commit(cursor)
                 conn.commit()
-                return True
+                return cursor
             except sqlite3.Error as e:
-                logging.error(f"Error executing query: {str(e)}")
-                QMessageBox.critical(None, f"Database Error ({db_name})", f"Error executing query: {str(e)}")
+                self.report_error(f"Database Error ({db_name})", f"Error executing query: {str(e)}")
                 conn.rollback()
         else:
-            logging.error(f"Database {db_name} not found.")
-            QMessageBox.critical(None, "Database Error", f"Database {db_name} not found.")
-        return False
+            self.report_error("Database Error", f"Database {db_name} not found.")
+        return None
+
+    def add_change_listener(self, listener):
+        if listener not in self.change_listeners:
+            self.change_listeners.append(listener)
+
+    def remove_change_listener(self, listener):
+        if listener in self.change_listeners:
+            self.change_listeners.remove(listener)
+
+    def notify_change(self, event):
+        logging.info(f"Change event: {event}")
+        for listener in list(self.change_listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logging.error(f"Change listener failed for {event}: {str(e)}")
+
+    @synchronized
+    def fetch_rows(self, db_name, table_name, condition, condition_params=None):
+        if db_name not in self.connections:
+            return {}
+        try:
+            cursor = self.connections[db_name].execute(
+                f"SELECT * FROM {table_name} WHERE {condition}", condition_params or ())
+        except sqlite3.Error as e:
+            logging.error(f"Error fetching rows from {table_name}: {str(e)}")
+            return {}
+        columns = [column[0] for column in cursor.description]
+        return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    @synchronized
+    def fetch_rows_by_id(self, db_name, table_name, row_ids):
+        rows = {}
+        for chunk in chunked(row_ids):
+            placeholders = ', '.join(['?' for _ in chunk])
+            rows.update(self.fetch_rows(db_name, table_name, f"id IN ({placeholders})", chunk))
+        return rows
+
+    def log_changes(self, db_name, table_name, action, row_ids, previous_rows):
+        if (db_name, table_name) not in self.logged_tables:
+            return
+        conn = self.connections[db_name]
+        current_rows = {}
+        if action != ChangeEvent.DELETED:
+            current_rows = self.fetch_rows_by_id(db_name, table_name, row_ids)
+        for row_id in row_ids:
+            self.record_row_change(conn, previous_rows.get(row_id), current_rows.get(row_id))
+
+    def record_row_change(self, conn, previous, current):
+        # Peers match rows by product code, a renamed code retires the old one
+        if previous and (current is None or previous['product_code'] != current['product_code']):
+            record_change(conn, self.origin_id, DELETE, previous)
+        if current:
+            record_change(conn, self.origin_id, UPSERT, current)
+
+    def log_archived_change(self, previous, current):
+        # Archived codes live in another file, so their log entry is a separate commit in Codes.db
+        conn = self.connections[self.codes_db]
+        try:
+            self.record_row_change(conn, previous, current)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logging.error(f"Could not log change to archived code: {str(e)}")
+        self.advance_code_filter_state()
 
+    @synchronized
     def add_new_entry(self, db_name, table_name, data):
         columns = ', '.join(data.keys())
         placeholders = ', '.join(['?' for _ in data])
         query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        return self.execute_query(db_name, query, list(data.values()))
+        row_ids = []
 
-    def update_entry(self, db_name, table_name, data, condition):
+        def record_insert(cursor):
+            row_ids.append(self.inserted_row_id(self.connections[db_name], table_name, cursor, data))
+            self.log_changes(db_name, table_name, ChangeEvent.INSERTED, row_ids, {})
+
+        if self.execute_write(db_name, query, list(data.values()), record_insert) is None:
+            return False
+        self.apply_to_replica(db_name, table_name, ChangeEvent.INSERTED, row_ids)
+        self.notify_change(ChangeEvent(db_name, table_name, ChangeEvent.INSERTED, row_ids))
+        return True
+
+    @synchronized
+    def add_new_entries(self, db_name, table_name, rows):
+        if db_name not in self.connections:
+            self.report_error("Database Error", f"Database {db_name} not found.")
+            return False
+        conn = self.connections[db_name]
+        row_ids = []
+        try:
+            for data in rows:
+                columns = ', '.join(data.keys())
+                placeholders = ', '.join(['?' for _ in data])
+                cursor = conn.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})",
+                                      list(data.values()))
+                row_ids.append(self.inserted_row_id(conn, table_name, cursor, data))
+            self.log_changes(db_name, table_name, ChangeEvent.INSERTED, row_ids, {})
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            self.report_error(f"Database Error ({db_name})", f"Error inserting rows: {str(e)}")
+            return False
+        logging.info(f"Inserted {len(row_ids)} rows into {table_name}")
+        if row_ids:
+            self.apply_to_replica(db_name, table_name, ChangeEvent.INSERTED, row_ids)
+            self.notify_change(ChangeEvent(db_name, table_name, ChangeEvent.INSERTED, row_ids))
+        return True
+
+    @synchronized
+    def update_entry(self, db_name, table_name, data, condition, condition_params=None):
         set_clause = ', '.join([f"{column} = ?" for column in data.keys()])
         query = f"UPDATE {table_name} SET {set_clause} WHERE {condition}"
-        return self.execute_query(db_name, query, list(data.values()))
+        previous_rows = self.fetch_rows(db_name, table_name, condition, condition_params)
+        row_ids = list(previous_rows)
+        cursor = self.execute_write(
+            db_name, query, list(data.values()) + list(condition_params or ()),
+            lambda cursor: self.log_changes(db_name, table_name, ChangeEvent.UPDATED, row_ids, previous_rows))
+        if cursor is None:
+            return False
+        if row_ids:
+            self.apply_to_replica(db_name, table_name, ChangeEvent.UPDATED, row_ids)
+            self.notify_change(ChangeEvent(db_name, table_name, ChangeEvent.UPDATED, row_ids, previous_rows))
+        return True
 
-    def delete_entry(self, db_name, table_name, condition):
+    @synchronized
+    def delete_entry(self, db_name, table_name, condition, condition_params=None, record_changes=True):
         query = f"DELETE FROM {table_name} WHERE {condition}"
-        return self.execute_query(db_name, query)
+        previous_rows = self.fetch_rows(db_name, table_name, condition, condition_params)
+        row_ids = list(previous_rows)
+        log_deletion = None
+        if record_changes:
+            def log_deletion(cursor):
+                self.log_changes(db_name, table_name, ChangeEvent.DELETED, row_ids, previous_rows)
+        cursor = self.execute_write(db_name, query, condition_params, log_deletion)
+        if cursor is None:
+            return False
+        if row_ids:
+            self.apply_to_replica(db_name, table_name, ChangeEvent.DELETED, row_ids)
+            self.notify_change(ChangeEvent(db_name, table_name, ChangeEvent.DELETED, row_ids, previous_rows))
+        return True
+
+    def search_product_codes(self, text, code_type_filter="Default", status_filter="Default", row_ids=None,
+                             limit=None, include_archive=False):
+        condition = "(product_code LIKE ? OR product_name LIKE ?)"
+        search_text = f"%{text}%"
+        parameters = [search_text, search_text]
+
+        if code_type_filter != "Default":
+            condition += " AND code_type = ?"
+            parameters.append(code_type_filter)
+
+        if status_filter != "Default":
+            condition += " AND used_status = ?"
+            parameters.append(status_filter)
+
+        query = f"""
+            SELECT id, product_name, product_code, code_type, used_status
+            FROM product_codes
+            WHERE {condition}
+        """
+        if row_ids is not None:
+            sources = [(self.codes_db, query)]
+            if include_archive and self.archive_db in self.connections:
+                sources.append((self.archive_db, query.replace("FROM product_codes", "FROM archived_codes")))
+            results = []
+            for db_name, source_query in sources:
+                for chunk in chunked(row_ids):
+                    chunk_query = source_query + f" AND id IN ({', '.join(['?' for _ in chunk])})"
+                    results.extend(self.fetch_data(db_name, chunk_query, tuple(parameters + chunk)))
+            return results
+
+        query += " ORDER BY product_name"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        results = self.fetch_data(self.codes_db, query, tuple(parameters))
+        if not include_archive or self.archive_db not in self.connections:
+            return results
+
+        archive_query = query.replace("FROM product_codes", "FROM archived_codes")
+        archived = self.fetch_data(self.archive_db, archive_query, tuple(parameters))
+        merged = heapq.merge(results, archived, key=lambda row: row[1])
+        return list(merged)[:limit] if limit is not None else list(merged)
+
+    def find_product_code(self, product_code):
+        rows = self.fetch_rows(self.codes_db, 'product_codes', "product_code = ?", (product_code,))
+        if not rows and self.archive_db in self.connections:
+            rows = self.fetch_rows(self.archive_db, 'archived_codes', "product_code = ?", (product_code,))
+        return next(iter(rows.values()), None)
+
+    def get_product_code(self, product_id):
+        row = self.fetch_rows(self.codes_db, 'product_codes', "id = ?", (product_id,)).get(product_id)
+        if row is None and self.archive_db in self.connections:
+            row = self.fetch_rows(self.archive_db, 'archived_codes', "id = ?", (product_id,)).get(product_id)
+        return row
+
+    @synchronized
+    def product_code_exists(self, product_code, check_current=True):
+        # A filter miss is definite, only possible hits need the indexed lookups
+        if product_code not in self.get_code_filter(check_current):
+            self.code_filter_stats['skipped'] += 1
+            return False
+        self.code_filter_stats['checked'] += 1
+
+        query = "SELECT 1 FROM product_codes WHERE product_code = ? LIMIT 1"
+        if self.fetch_data(self.codes_db, query, (product_code,)):
+            return True
+        # Archived codes still count, a vendor re-sending one must not bring it back
+        if self.archive_db in self.connections:
+            archive_query = "SELECT 1 FROM archived_codes WHERE product_code = ? LIMIT 1"
+            if self.fetch_data(self.archive_db, archive_query, (product_code,)):
+                return True
+        self.code_filter_stats['false_positives'] += 1
+        return False
+
+    @synchronized
+    def delete_product_code(self, product_id):
+        if self.fetch_rows(self.codes_db, 'product_codes', "id = ?", (product_id,)):
+            return self.delete_entry(self.codes_db, 'product_codes', "id = ?", (product_id,))
+        if self.archive_db not in self.connections:
+            return False
+        rows = self.fetch_rows(self.archive_db, 'archived_codes', "id = ?", (product_id,))
+        if not rows or not self.delete_entry(self.archive_db, 'archived_codes', "id = ?", (product_id,)):
+            return False
+        self.log_archived_change(rows[product_id], None)
+        return True
+
+    @synchronized
+    def update_archived_code(self, product_code, data):
+        if self.archive_db not in self.connections:
+            return False
+        rows = self.fetch_rows(self.archive_db, 'archived_codes', "product_code = ?", (product_code,))
+        if not rows:
+            return False
+        previous = next(iter(rows.values()))
+        if data.get('used_status') != 'Used':
+            # The archive only holds used codes, anything else goes back to the hot table.
+            # Inserted before the archived copy goes, so a failure never loses the code
+            if not self.add_new_entry(self.codes_db, 'product_codes', dict(data, id=previous['id'])):
+                return False
+            return self.delete_entry(self.archive_db, 'archived_codes', "id = ?", (previous['id'],))
+        if not self.update_entry(self.archive_db, 'archived_codes', data, "id = ?", (previous['id'],)):
+            return False
+        current = self.fetch_rows(self.archive_db, 'archived_codes', "id = ?", (previous['id'],)).get(previous['id'])
+        self.log_archived_change(previous, current)
+        return True
+
+    @synchronized
+    def archive_used_codes(self, older_than_days=None, batch_size=500, max_batches=None):
+        if self.archive_db not in self.connections:
+            return 0
+        days = self.archive_after_days if older_than_days is None else older_than_days
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        codes_conn = self.connections[self.codes_db]
+        archive_conn = self.connections[self.archive_db]
+        moved = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            used_at = dict(codes_conn.execute(
+                "SELECT id, used_at FROM codes WHERE used_at IS NOT NULL AND used_at < ? ORDER BY used_at LIMIT ?",
+                (cutoff, batch_size)).fetchall())
+            if not used_at:
+                break
+            rows = self.fetch_rows_by_id(self.codes_db, 'product_codes', list(used_at))
+            archived_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            try:
+                archive_conn.executemany(
+                    '''INSERT OR REPLACE INTO archived_codes
+                       (id, product_name, product_code, code_type, used_status, used_at, archived_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    [(row['id'], row['product_name'], row['product_code'], row['code_type'], row['used_status'],
+                      used_at[row['id']], archived_at) for row in rows.values()])
+                archive_conn.commit()
+            except sqlite3.Error as e:
+                archive_conn.rollback()
+                self.report_error(f"Database Error ({self.archive_db})", f"Error archiving codes: {str(e)}")
+                break
+
+            # Copied first and deleted second, so a crash in between only leaves
+            # a duplicate that the next run replaces and removes
+            placeholders = ', '.join(['?' for _ in used_at])
+            if not self.delete_entry(self.codes_db, 'product_codes', f"id IN ({placeholders})", list(used_at),
+                                     record_changes=False):
+                break
+            moved += len(used_at)
+        if moved:
+            logging.info(f"Archived {moved} codes used before {cutoff} into {self.archive_db}")
+        return moved
+
+    @synchronized
+    def claim_product_code(self, product_name, code_type=None, attempts=3):
+        condition = "product_name = ? AND used_status = 'Available'"
+        parameters = [product_name]
+        if code_type:
+            condition += " AND code_type = ?"
+            parameters.append(code_type)
+        conn = self.connections[self.codes_db]
+        for _ in range(attempts):
+            try:
+                # Take the write lock before reading, so no other process can claim the same code in between
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(f"SELECT id FROM product_codes WHERE {condition} ORDER BY id LIMIT 1",
+                                   parameters).fetchone()
+                if row is None:
+                    conn.rollback()
+                    return None
+                product_id = row[0]
+                previous_rows = self.fetch_rows(self.codes_db, 'product_codes', "id = ?", (product_id,))
+                cursor = conn.execute(
+                    """UPDATE codes SET used_status = (SELECT id FROM code_statuses WHERE name = 'Used')
+                       WHERE id = ? AND used_status = (SELECT id FROM code_statuses WHERE name = 'Available')""",
+                    (product_id,))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    continue
+                self.log_changes(self.codes_db, 'product_codes', ChangeEvent.UPDATED, [product_id], previous_rows)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                self.report_error(f"Database Error ({self.codes_db})", f"Error claiming product code: {str(e)}")
+                return None
+            self.apply_to_replica(self.codes_db, 'product_codes', ChangeEvent.UPDATED, [product_id])
+            self.notify_change(ChangeEvent(self.codes_db, 'product_codes', ChangeEvent.UPDATED, [product_id],
+                                           previous_rows))
+            return self.fetch_rows(self.codes_db, 'product_codes', "id = ?", (product_id,)).get(product_id)
+        return None
+
+    @synchronized
+    def import_product_codes(self, rows):
+        required_fields = ['product_name', 'product_code', 'code_type', 'used_status']
+        result = {'added': 0, 'duplicates': 0, 'invalid': 0}
+        new_rows = []
+        seen = set()
+        # Outside writes are caught up once for the batch instead of checked for every code
+        self.get_code_filter()
+        for row in rows:
+            if any(not isinstance(row.get(field), str) or not row[field] for field in required_fields):
+                result['invalid'] += 1
+            elif row['product_code'] in seen or self.product_code_exists(row['product_code'], False):
+                result['duplicates'] += 1
+            else:
+                seen.add(row['product_code'])
+                new_rows.append({field: row[field] for field in required_fields})
+
+        if new_rows and self.add_new_entries(self.codes_db, 'product_codes', new_rows):
+            result['added'] = len(new_rows)
+        elif new_rows:
+            result['invalid'] += len(new_rows)
+        logging.info(f"Imported product codes: {result}, duplicate filter: {self.code_filter_stats}")
+        return result
+
+    def fetch_product_names(self):
+        return [row[0] for row in self.fetch_data(self.codes_db, "SELECT product_name FROM product_codes")]
+
+    def update_name_index(self, event):
+        if event.db_name != self.codes_db or event.table_name != 'product_codes':
+            return
+        for row in event.previous_rows.values():
+            self.name_index.remove(row['product_name'])
+        if event.action != ChangeEvent.DELETED:
+            for row in self.fetch_rows_by_id(event.db_name, event.table_name, event.row_ids).values():
+                self.name_index.add(row['product_name'])
+
+    @synchronized
+    def complete_product_name(self, prefix, limit=20):
+        return self.name_index.complete(prefix, limit)
+
+    def code_filter_sequences(self):
+        # Every insert bumps the codes sequence and every logged write the change log sequence
+        rows = dict(self.connections[self.codes_db].execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+        return rows.get('codes', 0), rows.get('change_log', 0)
+
+    def code_filter_fingerprint(self, sequences):
+        return f"{sequences[0]}:{sequences[1]}"
+
+    def capture_code_filter_state(self):
+        # Version first, a write landing in between only makes the filter look stale.
+        # Codes.db alone is enough: new archive rows come from codes inserted there first
+        version = self.data_version(self.connections[self.codes_db])
+        return version, self.code_filter_sequences()
+
+    def code_filter_is_current(self):
+        # The filter only follows this manager's writes, the service or another desk may add codes too
+        return self.code_filter_state[0] == self.data_version(self.connections[self.codes_db])
+
+    def advance_code_filter_state(self):
+        if self.code_filter is None:
+            return
+        if self.code_filter_is_current():
+            self.code_filter_state = (self.code_filter_state[0], self.code_filter_sequences())
+        else:
+            self.catch_up_code_filter()
+
+    def catch_up_code_filter(self):
+        # Other connections' writes all land above the sequences seen last: new ids in codes
+        # and the archive, and an upsert in the change log for every logged insert or rename
+        codes_seq, log_seq = self.code_filter_state[1]
+        self.code_filter_state = self.capture_code_filter_state()
+        conn = self.connections[self.codes_db]
+        codes = [row[0] for row in conn.execute("SELECT product_code FROM codes WHERE id > ?", (codes_seq,))]
+        codes += [row[0] for row in conn.execute(
+            "SELECT product_code FROM change_log WHERE seq > ? AND action = ?", (log_seq, UPSERT))]
+        if self.archive_db in self.connections:
+            codes += [row[0] for row in self.connections[self.archive_db].execute(
+                "SELECT product_code FROM archived_codes WHERE id > ?", (codes_seq,))]
+        for product_code in codes:
+            self.code_filter.add(product_code)
+        logging.info(f"Caught up duplicate filter with {len(codes)} codes written elsewhere")
+
+    @synchronized
+    def get_code_filter(self, check_current=True):
+        if self.code_filter is None or self.code_filter.is_full():
+            self.code_filter_state = self.capture_code_filter_state()
+            self.code_filter = self.build_code_filter()
+        elif check_current and not self.code_filter_is_current():
+            self.catch_up_code_filter()
+        return self.code_filter
+
+    def build_code_filter(self):
+        codes = [row[0] for row in self.connections[self.codes_db].execute("SELECT product_code FROM codes")]
+        if self.archive_db in self.connections:
+            codes += [row[0] for row in self.connections[self.archive_db].execute(
+                "SELECT product_code FROM archived_codes")]
+        # Headroom so ordinary imports don't force a rebuild
+        code_filter = BloomFilter(max(100000, len(codes) * 2))
+        for product_code in codes:
+            code_filter.add(product_code)
+        logging.info(f"Built duplicate filter over {len(codes)} product codes")
+        return code_filter
+
+    def update_code_filter(self, event):
+        if event.db_name not in (self.codes_db, self.archive_db):
+            return
+        self.advance_code_filter_state()
+        if self.code_filter is None or event.action == ChangeEvent.DELETED:
+            return
+        for row in self.fetch_rows_by_id(event.db_name, event.table_name, event.row_ids).values():
+            self.code_filter.add(row['product_code'])
+
+    @synchronized
+    def close(self):
+        try:
+            sequences = self.code_filter_sequences()
+            if (self.code_filter is not None and self.code_filter_is_current()
+                    and sequences == self.code_filter_state[1]):
+                self.code_filter.save(self.code_filter_path, self.code_filter_fingerprint(sequences))
+            elif os.path.exists(self.code_filter_path):
+                # Dropped after a raw query or outdated by another connection's writes
+                os.remove(self.code_filter_path)
+        except OSError as e:
+            logging.error(f"Could not save duplicate filter: {str(e)}")
+        for replica in self.replicas.values():
+            replica.close()
+        self.replicas = {}
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = {}
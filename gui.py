@@ -2,12 +2,13 @@ import csv
 import logging
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton,
-    QFormLayout, QFrame, QMessageBox, QComboBox, QInputDialog,
+    QFormLayout, QFrame, QMessageBox, QComboBox, QInputDialog, QCheckBox,
     QApplication, QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView
 )
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import Qt
-from special_classes import EnterLineEdit
+from PyQt5.QtCore import Qt, QTimer
+from special_classes import EnterLineEdit, PrefixCompleter
+from db_control import ChangeEvent
 
 
 class ProductInfoSection(QWidget):
@@ -94,6 +95,7 @@ class ProductSelectionSection(QWidget):
         self.layout = None
         self.code_type_refine_combo = None
         self.status_refine_combo = None
+        self.include_archive_checkbox = None
         self.initializeUI()
 
     def initializeUI(self):
@@ -116,6 +118,9 @@ class ProductSelectionSection(QWidget):
         self.layout.addWidget(QLabel("Status Refine"))
         self.layout.addWidget(self.status_refine_combo)
 
+        self.include_archive_checkbox = QCheckBox("Include Archive")
+        self.layout.addWidget(self.include_archive_checkbox)
+
     def setupUploadButton(self):
         upload_button = QPushButton("Upload CSV")
         upload_button.clicked.connect(self.openFileDialog)
@@ -151,14 +156,10 @@ class ProductSelectionSection(QWidget):
             logging.info(f"Total rows processed: {row_count}")
 
     def checkIfProductCodeExists(self, product_code):
-        query = "SELECT * FROM product_codes WHERE product_code = ?"
-        parameters = (product_code,)
         logging.info(f"Checking if product code exists: {product_code}")
-        logging.info(f"Query: {query}")
-        logging.info(f"Parameters: {parameters}")
-        result = self.db_manager.fetch_data('Codes.db', query, parameters)
-        logging.info(f"Query result: {result}")
-        return len(result) > 0
+        exists = self.db_manager.product_code_exists(product_code)
+        logging.info(f"Product code exists: {exists}")
+        return exists
 
     def addNewProduct(self, product_data):
         try:
@@ -170,7 +171,7 @@ class ProductSelectionSection(QWidget):
 
             # Add the new product to the database
             success = self.db_manager.add_new_entry(
-                'Codes.db', 'product_codes', {
+                self.db_manager.codes_db, 'product_codes', {
                     'product_name': product_data['Product Name'],
                     'product_code': product_data['Product Code'],
                     'code_type': product_data['Product Code Type'],
@@ -179,7 +180,6 @@ class ProductSelectionSection(QWidget):
 
             if success:
                 logging.info(f"New product added successfully: {product_data}")
-                self.product_code_list_section.searchProductCodes("")
             else:
                 raise Exception("Failed to add new product")
 
@@ -193,6 +193,9 @@ class ProductSelectionSection(QWidget):
     def getStatusFilter(self):
         return self.status_refine_combo.currentText()
 
+    def getIncludeArchive(self):
+        return self.include_archive_checkbox.isChecked()
+
 
 class ProductCodeListSection(QWidget):
     def __init__(self, db_manager):
@@ -201,7 +204,11 @@ class ProductCodeListSection(QWidget):
         self.layout = None
         self.code_search_bar = None
         self.product_code_table = None
+        self.active_filter = ("", "Default", "Default", False)
+        self.row_items = {}
         self.initializeUI()
+        self.db_manager.add_change_listener(self.applyChange)
+        self.destroyed.connect(lambda: self.db_manager.remove_change_listener(self.applyChange))
 
     def initializeUI(self):
         self.layout = QVBoxLayout()
@@ -238,46 +245,78 @@ class ProductCodeListSection(QWidget):
 
         self.layout.addWidget(self.product_code_table)
 
-    def searchProductCodes(self, text, code_type_filter, status_filter):
-        query = """
-            SELECT id, product_name, product_code, code_type, used_status
-            FROM product_codes
-            WHERE (product_code LIKE ? OR product_name LIKE ?)
-        """
-        search_text = f"%{text}%"
-        parameters = [search_text, search_text]
-
-        if code_type_filter != "Default":
-            query += " AND code_type = ?"
-            parameters.append(code_type_filter)
-
-        if status_filter != "Default":
-            query += " AND used_status = ?"
-            parameters.append(status_filter)
-
-        query += " ORDER BY product_name"
-        results = self.db_manager.fetch_data('Codes.db', query, tuple(parameters))
+    def searchProductCodes(self, text, code_type_filter, status_filter, include_archive=False):
+        self.active_filter = (text, code_type_filter, status_filter, include_archive)
+        results = self.db_manager.search_product_codes(
+            text, code_type_filter, status_filter, include_archive=include_archive)
         self.populateTable(results)
 
     def populateTable(self, data):
         self.product_code_table.setSortingEnabled(False)
         self.product_code_table.setRowCount(0)
+        self.row_items = {}
 
         for row_number, row_data in enumerate(data):
             self.product_code_table.insertRow(row_number)
-            for column_number, data in enumerate(row_data):
-                item = QTableWidgetItem(str(data))
-                adjusted_column_number = column_number if column_number < 3 else column_number + 1
-                self.product_code_table.setItem(row_number, adjusted_column_number, item)
+            self.setRowData(row_number, row_data)
+
+        self.product_code_table.setSortingEnabled(True)
 
-                if adjusted_column_number in [0, 2, 4, 5]:
-                    item.setTextAlignment(Qt.AlignCenter)
+    def setRowData(self, row_number, row_data):
+        for column_number, data in enumerate(row_data):
+            item = QTableWidgetItem(str(data))
+            adjusted_column_number = column_number if column_number < 3 else column_number + 1
+            self.product_code_table.setItem(row_number, adjusted_column_number, item)
 
-                if column_number == 3:
-                    blank_item = QTableWidgetItem("")
-                    self.product_code_table.setItem(row_number, column_number, blank_item)
+            if adjusted_column_number in [0, 2, 4, 5]:
+                item.setTextAlignment(Qt.AlignCenter)
 
-        self.product_code_table.setSortingEnabled(True)
+            if column_number == 3:
+                blank_item = QTableWidgetItem("")
+                self.product_code_table.setItem(row_number, column_number, blank_item)
+
+        self.row_items[row_data[0]] = self.product_code_table.item(row_number, 0)
+
+    def applyChange(self, event):
+        if (event.db_name, event.table_name) not in [(self.db_manager.codes_db, 'product_codes'),
+                                                     (self.db_manager.archive_db, 'archived_codes')]:
+            return
+
+        # Deleted rows may still match in the archive, the archiver moves codes there
+        matching_rows = {row[0]: row for row in self.fetchMatchingRows(event.row_ids)}
+
+        # Sorting stays off while patching so the table is re-sorted once per event, not once per row
+        sorting_enabled = self.product_code_table.isSortingEnabled()
+        self.product_code_table.setSortingEnabled(False)
+        for product_id in event.row_ids:
+            if product_id in matching_rows:
+                self.upsertRow(matching_rows[product_id])
+            else:
+                self.removeRow(product_id)
+        self.product_code_table.setSortingEnabled(sorting_enabled)
+
+    def fetchMatchingRows(self, row_ids):
+        text, code_type_filter, status_filter, include_archive = self.active_filter
+        return self.db_manager.search_product_codes(
+            text, code_type_filter, status_filter, row_ids=row_ids, include_archive=include_archive)
+
+    def upsertRow(self, row_data):
+        id_item = self.row_items.get(row_data[0])
+        if id_item is None:
+            row_number = self.product_code_table.rowCount()
+            self.product_code_table.insertRow(row_number)
+            self.setRowData(row_number, row_data)
+            return
+
+        row_number = id_item.row()
+        for column_number, data in enumerate(row_data[1:], start=1):
+            adjusted_column_number = column_number if column_number < 3 else column_number + 1
+            self.product_code_table.item(row_number, adjusted_column_number).setText(str(data))
+
+    def removeRow(self, product_id):
+        id_item = self.row_items.pop(product_id, None)
+        if id_item is not None:
+            self.product_code_table.removeRow(id_item.row())
 
     def getSelectedProductCode(self):
         selected_items = self.product_code_table.selectedItems()
@@ -289,14 +328,10 @@ class ProductCodeListSection(QWidget):
         row = self.product_code_table.currentRow()
         if row >= 0:
             product_id = int(self.product_code_table.item(row, 0).text())
-            query = """
-                SELECT product_name, product_code, code_type, used_status
-                FROM product_codes 
-                WHERE id = ?
-            """
-            product_data = self.db_manager.fetch_data('Codes.db', query, (product_id,))
+            product_data = self.db_manager.get_product_code(product_id)
             if product_data:
-                return product_data[0]
+                return (product_data['product_name'], product_data['product_code'],
+                        product_data['code_type'], product_data['used_status'])
         return None
 
 
@@ -352,19 +387,28 @@ class ButtonSection(QWidget):
         logging.info(f"Submitting product code: {product_code}")
 
         existing_game_code = self.db_manager.fetch_data(
-            'Codes.db', "SELECT * FROM product_codes WHERE product_code = ?", (product_code,))
+            self.db_manager.codes_db, "SELECT * FROM product_codes WHERE product_code = ?", (product_code,))
 
         if existing_game_code:
-            condition = f"product_code = '{product_code}'"
-            success = self.db_manager.update_entry('Codes.db', 'product_codes', product_code_data, condition)
+            success = self.db_manager.update_entry(
+                self.db_manager.codes_db, 'product_codes', product_code_data, "product_code = ?", (product_code,))
             if success:
                 logging.info(f"Product code updated successfully: {product_code}")
                 QMessageBox.information(self, "Updated", "Product code updated successfully.")
             else:
                 logging.error(f"Failed to update product code: {product_code}")
                 QMessageBox.critical(self, "Error", "Failed to update product code.")
+        elif self.db_manager.find_product_code(product_code) is not None:
+            # Only in the archive, updating it there keeps the code from existing twice
+            success = self.db_manager.update_archived_code(product_code, product_code_data)
+            if success:
+                logging.info(f"Archived product code updated successfully: {product_code}")
+                QMessageBox.information(self, "Updated", "Archived product code updated successfully.")
+            else:
+                logging.error(f"Failed to update archived product code: {product_code}")
+                QMessageBox.critical(self, "Error", "Failed to update archived product code.")
         else:
-            success = self.db_manager.add_new_entry('Codes.db', 'product_codes', product_code_data)
+            success = self.db_manager.add_new_entry(self.db_manager.codes_db, 'product_codes', product_code_data)
             if success:
                 logging.info(f"New product code added successfully: {product_code}")
                 QMessageBox.information(self, "Added", "New product code added successfully.")
@@ -372,10 +416,6 @@ class ButtonSection(QWidget):
                 logging.error(f"Failed to add new product code: {product_code}")
                 QMessageBox.critical(self, "Error", "Failed to add new product code.")
 
-        code_type_filter = self.product_selection_section.getCodeTypeFilter()
-        status_filter = self.product_selection_section.getStatusFilter()
-        self.product_code_list_section.searchProductCodes("", code_type_filter, status_filter)
-
     def deleteProductCode(self):
         primary_key = self.product_code_list_section.getSelectedProductCode()
         if primary_key is None:
@@ -395,13 +435,9 @@ class ButtonSection(QWidget):
         return ok and text.lower() == 'delete'
 
     def performDeletion(self, primary_key):
-        condition = f"id = {primary_key}"
-        success = self.db_manager.delete_entry('Codes.db', 'product_codes', condition)
+        success = self.db_manager.delete_product_code(primary_key)
         if success:
             logging.info(f"Product code deleted successfully: {primary_key}")
-            code_type_filter = self.product_selection_section.getCodeTypeFilter()
-            status_filter = self.product_selection_section.getStatusFilter()
-            self.product_code_list_section.searchProductCodes("", code_type_filter, status_filter)
             QMessageBox.information(self, "Deleted", "Product code deleted successfully.")
         else:
             logging.error(f"Failed to delete product code: {primary_key}")
@@ -425,6 +461,7 @@ class ClientWindow(QMainWindow):
         self.product_code_list_section = None
         self.product_selection_section = None
         self.button_section = None
+        self.search_timer = None
         self.initializeUI()
 
     def initializeUI(self):
@@ -449,8 +486,17 @@ class ClientWindow(QMainWindow):
 
         self.product_selection_section.code_type_refine_combo.currentTextChanged.connect(self.refineSearch)
         self.product_selection_section.status_refine_combo.currentTextChanged.connect(self.refineSearch)
+        self.product_selection_section.include_archive_checkbox.toggled.connect(self.refineSearch)
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.searchProductCodes)
+        self.product_code_list_section.code_search_bar.textChanged.connect(lambda: self.search_timer.start())
+
+        PrefixCompleter(self.db_manager.complete_product_name, self.product_info_section.product_name_entry)
+        PrefixCompleter(self.db_manager.complete_product_name, self.product_code_list_section.code_search_bar)
 
-        self.product_code_list_section.code_search_bar.textChanged.connect(self.searchProductCodes)
         self.product_code_list_section.product_code_table.itemDoubleClicked.connect(self.loadProductCodeData)
         self.product_code_list_section.product_code_table.itemDoubleClicked.connect(self.copyProductCode)
 
@@ -460,7 +506,8 @@ class ClientWindow(QMainWindow):
         search_text = self.product_code_list_section.code_search_bar.text()
         code_type_filter = self.product_selection_section.getCodeTypeFilter()
         status_filter = self.product_selection_section.getStatusFilter()
-        self.product_code_list_section.searchProductCodes(search_text, code_type_filter, status_filter)
+        include_archive = self.product_selection_section.getIncludeArchive()
+        self.product_code_list_section.searchProductCodes(search_text, code_type_filter, status_filter, include_archive)
 
     def loadProductCodeData(self, item):
         product_code_data = self.product_code_list_section.getSelectedProductCodeData()
@@ -478,4 +525,5 @@ class ClientWindow(QMainWindow):
         search_text = self.product_code_list_section.code_search_bar.text()
         code_type_filter = self.product_selection_section.getCodeTypeFilter()
         status_filter = self.product_selection_section.getStatusFilter()
-        self.product_code_list_section.searchProductCodes(search_text, code_type_filter, status_filter)
+        include_archive = self.product_selection_section.getIncludeArchive()
+        self.product_code_list_section.searchProductCodes(search_text, code_type_filter, status_filter, include_archive)
@@ -1,13 +1,15 @@
 import sys
 import logging
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QStackedWidget, QStatusBar
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QStackedWidget, QStatusBar, QMessageBox
 from PyQt5.QtCore import Qt
 from db_control import DatabaseManager
+from backup import BackupManager, read_backup_settings
+from maintenance import MaintenanceScheduler, read_maintenance_settings
 import xml.etree.ElementTree as ET
 from styles import apply_style, get_dark_style, get_light_style
 from gui import ClientWindow
 from settings_gui import SettingsWindow
-from special_classes import CustomTitleBar
+from special_classes import CustomTitleBar, IdleWatcher
 
 
 class MainWindow(QMainWindow):
@@ -44,6 +46,7 @@ class MainWindow(QMainWindow):
 
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
+        self.show_replica_status()
 
         self.button1 = QPushButton("Product Codes")
         self.button1.setMinimumHeight(25)
@@ -72,8 +75,16 @@ class MainWindow(QMainWindow):
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
 
+    def show_replica_status(self):
+        usage = self.db_manager.replica_memory_usage()
+        if usage:
+            details = ', '.join(f"{db_name} {size / (1024 * 1024):.1f} MB" for db_name, size in usage.items())
+            self.status_bar.showMessage(f"In-memory replicas: {details}")
+
     def reinitialize_app(self):
         current_page_index = self.stacked_widget.currentIndex()
+        # Deleted rather than hidden, so its widgets stop listening for database changes
+        self.setAttribute(Qt.WA_DeleteOnClose)
         self.close()
         new_main_window = MainWindow(self.db_manager)
         if current_page_index == 1:
@@ -93,7 +104,21 @@ def main():
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
     app = QApplication(sys.argv)
-    db_manager = DatabaseManager()
+    db_manager = DatabaseManager(error_handler=lambda title, message: QMessageBox.critical(None, title, message))
+    backup_settings = read_backup_settings()
+    backup_manager = BackupManager(db_manager, backup_settings['path'], backup_settings['interval_minutes'],
+                                   backup_settings['keep'], backup_settings['pages'])
+    backup_manager.start()
+    app.aboutToQuit.connect(backup_manager.stop)
+
+    maintenance_settings = read_maintenance_settings()
+    maintenance = MaintenanceScheduler(db_manager)
+    idle_watcher = IdleWatcher(app, maintenance_settings['idle_seconds'], maintenance_settings['interval_minutes'] * 60)
+    # A few batches per idle tick keep the UI thread responsive on a large backlog
+    idle_watcher.idle.connect(lambda: db_manager.archive_used_codes(max_batches=4))
+    idle_watcher.idle.connect(lambda: maintenance.run(maintenance_settings['budget_ms'] / 1000))
+    app.aboutToQuit.connect(lambda: maintenance.run(maintenance_settings['shutdown_budget_ms'] / 1000, at_shutdown=True))
+    app.aboutToQuit.connect(db_manager.close)
     mainWin = MainWindow(db_manager)
     mainWin.show()
     sys.exit(app.exec_())
@@ -0,0 +1,159 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+
+from schema import BENCHMARK_QUERIES
+from sync import prune_change_log
+
+INCREMENTAL_VACUUM = 2
+# Conservative VACUUM throughput, it rewrites the whole file and cannot stop at the deadline
+VACUUM_PAGES_PER_SECOND = 10000
+
+
+def read_maintenance_settings(settings_file='settings.xml'):
+    settings = {'idle_seconds': 60, 'interval_minutes': 30, 'budget_ms': 500, 'shutdown_budget_ms': 5000}
+    try:
+        root = ET.parse(settings_file).getroot()
+    except (FileNotFoundError, ET.ParseError):
+        logging.warning("Could not read maintenance settings, using defaults.")
+        return settings
+
+    for key in settings:
+        value = root.findtext(f'maintenance/{key}')
+        if value is None or not value.strip():
+            continue
+        try:
+            settings[key] = int(value)
+        except ValueError:
+            logging.warning(f"Invalid maintenance setting {key}: {value}")
+    return settings
+
+
+class MaintenanceScheduler:
+    def __init__(self, db_manager, vacuum_step_pages=128, analyze_after_changes=1000, prune_step_entries=1000):
+        self.db_manager = db_manager
+        self.vacuum_step_pages = vacuum_step_pages
+        self.prune_step_entries = prune_step_entries
+        self.prune_position = 0
+        self.analyze_after_changes = analyze_after_changes
+        self.changes_since_analyze = {db_name: analyze_after_changes for db_name in db_manager.databases}
+        self.history = deque(maxlen=50)
+        self.db_manager.add_change_listener(self.count_change)
+
+    def count_change(self, event):
+        if event.db_name in self.changes_since_analyze:
+            self.changes_since_analyze[event.db_name] += len(event.row_ids)
+
+    def run(self, budget_seconds, at_shutdown=False):
+        deadline = time.perf_counter() + budget_seconds
+        reports = []
+        for db_name in self.db_manager.databases:
+            if time.perf_counter() >= deadline:
+                logging.info(f"Maintenance budget used up, skipping {db_name}")
+                break
+            with self.db_manager.lock:
+                report = self.maintain(db_name, deadline, at_shutdown)
+            self.history.append(report)
+            reports.append(report)
+            self.log_report(report)
+        return reports
+
+    def maintain(self, db_name, deadline, at_shutdown):
+        conn = self.db_manager.connections[db_name]
+        started = time.perf_counter()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        tasks = []
+        if db_name == self.db_manager.codes_db:
+            pruned = self.prune_change_log(conn, deadline)
+            tasks.append(f"pruned {pruned} change log entries")
+
+        # Measured after pruning, so the pages it frees count as reclaimed and can trigger the vacuum
+        report = {
+            'database': db_name,
+            'tasks': tasks,
+            'free_pages_before': self.free_pages(conn),
+            'plans_before': self.query_plans(conn, db_name),
+        }
+
+        conn.execute("PRAGMA optimize")
+        report['tasks'].append('optimize')
+
+        if self.changes_since_analyze[db_name] >= self.analyze_after_changes and time.perf_counter() < deadline:
+            # Sampled statistics keep ANALYZE short on big tables
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("ANALYZE")
+            conn.commit()
+            self.changes_since_analyze[db_name] = 0
+            report['tasks'].append('analyze')
+
+        if time.perf_counter() < deadline:
+            mode = 'TRUNCATE' if at_shutdown else 'PASSIVE'
+            busy, wal_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+            report['tasks'].append(f"checkpoint {checkpointed}/{wal_pages} pages")
+
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if auto_vacuum == INCREMENTAL_VACUUM:
+            steps = 0
+            while self.free_pages(conn) and time.perf_counter() < deadline:
+                # execute() only steps once, freeing a single page; executescript runs it to completion
+                conn.executescript(f"PRAGMA incremental_vacuum({self.vacuum_step_pages})")
+                steps += 1
+            if steps:
+                report['tasks'].append(f"incremental_vacuum x{steps}")
+        elif at_shutdown and report['free_pages_before']:
+            # Switching modes needs one full VACUUM, only worth it on the way out and
+            # only when its estimated time fits what is left of the budget
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            estimate = page_count / VACUUM_PAGES_PER_SECOND
+            if estimate <= deadline - time.perf_counter():
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+                report['tasks'].append('vacuum to incremental auto_vacuum')
+            else:
+                report['tasks'].append(f"vacuum skipped, {page_count} pages need about {estimate:.1f}s")
+
+        report['free_pages_after'] = self.free_pages(conn)
+        report['reclaimed_bytes'] = (report['free_pages_before'] - report['free_pages_after']) * page_size
+        report['plans_after'] = self.query_plans(conn, db_name)
+
+        replica = self.db_manager.replicas.get(db_name)
+        if replica is not None:
+            replica.execute("PRAGMA optimize")
+
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        return report
+
+    def prune_change_log(self, conn, deadline):
+        # Works through the log in seq ranges and picks up where the last run stopped
+        last_seq = conn.execute("SELECT coalesce(max(seq), 0) FROM change_log").fetchone()[0]
+        pruned = 0
+        while time.perf_counter() < deadline:
+            if self.prune_position >= last_seq:
+                self.prune_position = 0
+                break
+            first = self.prune_position + 1
+            self.prune_position += self.prune_step_entries
+            pruned += prune_change_log(conn, first, self.prune_position)
+        return pruned
+
+    def free_pages(self, conn):
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def query_plans(self, conn, db_name):
+        if db_name != self.db_manager.codes_db:
+            return {}
+        plans = {}
+        for name, (query, params) in BENCHMARK_QUERIES.items():
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            plans[name] = '; '.join(row[-1] for row in rows)
+        return plans
+
+    def log_report(self, report):
+        logging.info(f"Maintenance on {report['database']} took {report['seconds']}s: {', '.join(report['tasks'])}; "
+                     f"reclaimed {report['reclaimed_bytes']} bytes "
+                     f"({report['free_pages_before']} -> {report['free_pages_after']} free pages)")
+        for name, plan in report['plans_after'].items():
+            before = report['plans_before'].get(name)
+            if before != plan:
+                logging.info(f"Query plan for {name} changed: {before} -> {plan}")
@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import math
+import os
+import struct
+
+MAGIC = b'CBF1'
+HEADER = struct.Struct('<4sQIQQH')
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.bit_count = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / self.capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # Double hashing: k positions out of one 128-bit digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        # Same positions as add(), but most misses stop at the first clear bit
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        position = int.from_bytes(digest[:8], 'little') % self.bit_count
+        step = (int.from_bytes(digest[8:], 'little') | 1) % self.bit_count
+        bits = self.bits
+        for _ in range(self.hash_count):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position = (position + step) % self.bit_count
+        return True
+
+    def is_full(self):
+        return self.count > self.capacity
+
+    def save(self, path, fingerprint):
+        encoded = fingerprint.encode('utf-8')
+        header = HEADER.pack(MAGIC, self.bit_count, self.hash_count, self.count, self.capacity, len(encoded))
+        partial = path + '.part'
+        with open(partial, 'wb') as file:
+            file.write(header)
+            file.write(encoded)
+            file.write(self.bits)
+        os.replace(partial, path)
+
+
+def load_bloom_filter(path, fingerprint):
+    try:
+        with open(path, 'rb') as file:
+            magic, bit_count, hash_count, count, capacity, fingerprint_length = HEADER.unpack(file.read(HEADER.size))
+            stored_fingerprint = file.read(fingerprint_length).decode('utf-8')
+            bits = bytearray(file.read())
+    except (OSError, struct.error, UnicodeDecodeError) as e:
+        logging.info(f"No usable membership filter at {path}: {str(e)}")
+        return None
+
+    if magic != MAGIC or stored_fingerprint != fingerprint or len(bits) != (bit_count + 7) // 8:
+        logging.info(f"Membership filter at {path} is stale, rebuilding")
+        return None
+    bloom = BloomFilter(capacity)
+    bloom.bit_count = bit_count
+    bloom.hash_count = hash_count
+    bloom.bits = bits
+    bloom.count = count
+    return bloom
@@ -0,0 +1,57 @@
+import bisect
+
+
+class PrefixIndex:
+    def __init__(self, names=()):
+        self.counts = {}
+        self.keys = []
+        self.build(names)
+
+    def build(self, names):
+        counts = {}
+        for name in names:
+            if name:
+                counts[name] = counts.get(name, 0) + 1
+        self.counts = counts
+        # Sorted case-folded keys, a prefix match is one bisect plus a short scan
+        self.keys = sorted((name.casefold(), name) for name in counts)
+
+    def add(self, name):
+        if not name:
+            return
+        if name in self.counts:
+            self.counts[name] += 1
+            return
+        self.counts[name] = 1
+        bisect.insort(self.keys, (name.casefold(), name))
+
+    def remove(self, name):
+        count = self.counts.get(name)
+        if count is None:
+            return
+        if count > 1:
+            self.counts[name] = count - 1
+            return
+        del self.counts[name]
+        key = (name.casefold(), name)
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def complete(self, prefix, limit=20):
+        folded = prefix.casefold()
+        index = bisect.bisect_left(self.keys, (folded,))
+        results = []
+        while index < len(self.keys) and len(results) < limit:
+            key, name = self.keys[index]
+            if not key.startswith(folded):
+                break
+            results.append(name)
+            index += 1
+        return results
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        return name in self.counts
@@ -0,0 +1,204 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+
+# Views that stand in for an old table, mapped to the table that owns their ids
+VIEW_BASE_TABLES = {'product_codes': 'codes'}
+
+BENCHMARK_QUERIES = {
+    'search': ("SELECT id, product_name, product_code, code_type, used_status FROM product_codes "
+               "WHERE (product_code LIKE ? OR product_name LIKE ?) ORDER BY product_name", ('%a%', '%a%')),
+    'filter': ("SELECT id, product_name, product_code, code_type, used_status FROM product_codes "
+               "WHERE (product_code LIKE ? OR product_name LIKE ?) AND code_type = ? AND used_status = ? "
+               "ORDER BY product_name", ('%%', '%%', 'Full Product', 'Available')),
+    'lookup': ("SELECT * FROM product_codes WHERE product_code = ?", ('UNKNOWN-CODE',)),
+    'claim': ("SELECT id FROM product_codes WHERE product_name = ? AND used_status = 'Available' LIMIT 1",
+              ('Unknown Product',)),
+}
+
+NORMALIZE_CODES = '''
+CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE) STRICT;
+CREATE TABLE code_types (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE) STRICT;
+CREATE TABLE code_statuses (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE) STRICT;
+INSERT INTO code_types (id, name) VALUES (0, 'Unknown'), (1, 'Full Product'), (2, 'Expansion/Addon');
+INSERT INTO code_statuses (id, name) VALUES (0, 'Unknown'), (1, 'Available'), (2, 'Used');
+
+CREATE TABLE codes
+    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+     product_id INTEGER NOT NULL REFERENCES products (id),
+     product_code TEXT NOT NULL,
+     code_type INTEGER NOT NULL REFERENCES code_types (id),
+     used_status INTEGER NOT NULL REFERENCES code_statuses (id)) STRICT;
+
+INSERT OR IGNORE INTO products (name) SELECT DISTINCT coalesce(product_name, '') FROM product_codes;
+INSERT OR IGNORE INTO code_types (name) SELECT DISTINCT coalesce(code_type, 'Unknown') FROM product_codes;
+INSERT OR IGNORE INTO code_statuses (name) SELECT DISTINCT coalesce(used_status, 'Unknown') FROM product_codes;
+INSERT INTO codes (id, product_id, product_code, code_type, used_status)
+    SELECT pc.id, p.id, coalesce(pc.product_code, ''), t.id, s.id
+    FROM product_codes pc
+    JOIN products p ON p.name = coalesce(pc.product_name, '')
+    JOIN code_types t ON t.name = coalesce(pc.code_type, 'Unknown')
+    JOIN code_statuses s ON s.name = coalesce(pc.used_status, 'Unknown');
+DROP TABLE product_codes;
+
+CREATE INDEX idx_codes_product_code ON codes (product_code);
+CREATE INDEX idx_codes_product ON codes (product_id, used_status);
+
+CREATE VIEW product_codes AS
+    SELECT c.id, p.name AS product_name, c.product_code, t.name AS code_type, s.name AS used_status
+    FROM codes c
+    JOIN products p ON p.id = c.product_id
+    JOIN code_types t ON t.id = c.code_type
+    JOIN code_statuses s ON s.id = c.used_status;
+
+CREATE TRIGGER product_codes_insert INSTEAD OF INSERT ON product_codes
+BEGIN
+    INSERT OR IGNORE INTO products (name) VALUES (coalesce(NEW.product_name, ''));
+    INSERT OR IGNORE INTO code_types (name) VALUES (coalesce(NEW.code_type, 'Unknown'));
+    INSERT OR IGNORE INTO code_statuses (name) VALUES (coalesce(NEW.used_status, 'Unknown'));
+    INSERT INTO codes (id, product_id, product_code, code_type, used_status) VALUES (
+        NEW.id,
+        (SELECT id FROM products WHERE name = coalesce(NEW.product_name, '')),
+        coalesce(NEW.product_code, ''),
+        (SELECT id FROM code_types WHERE name = coalesce(NEW.code_type, 'Unknown')),
+        (SELECT id FROM code_statuses WHERE name = coalesce(NEW.used_status, 'Unknown')));
+END;
+
+CREATE TRIGGER product_codes_update INSTEAD OF UPDATE ON product_codes
+BEGIN
+    INSERT OR IGNORE INTO products (name) VALUES (coalesce(NEW.product_name, ''));
+    INSERT OR IGNORE INTO code_types (name) VALUES (coalesce(NEW.code_type, 'Unknown'));
+    INSERT OR IGNORE INTO code_statuses (name) VALUES (coalesce(NEW.used_status, 'Unknown'));
+    UPDATE codes SET
+        product_id = (SELECT id FROM products WHERE name = coalesce(NEW.product_name, '')),
+        product_code = coalesce(NEW.product_code, ''),
+        code_type = (SELECT id FROM code_types WHERE name = coalesce(NEW.code_type, 'Unknown')),
+        used_status = (SELECT id FROM code_statuses WHERE name = coalesce(NEW.used_status, 'Unknown'))
+    WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER product_codes_delete INSTEAD OF DELETE ON product_codes
+BEGIN
+    DELETE FROM codes WHERE id = OLD.id;
+END;
+'''
+
+TRACK_USED_AT = '''
+ALTER TABLE codes ADD COLUMN used_at TEXT;
+UPDATE codes SET used_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+    WHERE used_status = (SELECT id FROM code_statuses WHERE name = 'Used');
+CREATE INDEX idx_codes_used_at ON codes (used_at) WHERE used_at IS NOT NULL;
+
+CREATE TRIGGER codes_used_at_insert AFTER INSERT ON codes
+    WHEN NEW.used_status = (SELECT id FROM code_statuses WHERE name = 'Used')
+BEGIN
+    UPDATE codes SET used_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now') WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER codes_used_at_update AFTER UPDATE OF used_status ON codes
+    WHEN NEW.used_status IS NOT OLD.used_status
+BEGIN
+    UPDATE codes SET used_at = CASE
+        WHEN NEW.used_status = (SELECT id FROM code_statuses WHERE name = 'Used')
+        THEN strftime('%Y-%m-%dT%H:%M:%SZ', 'now') END
+    WHERE id = NEW.id;
+END;
+'''
+
+PRUNE_PRODUCTS = '''
+DELETE FROM products WHERE NOT EXISTS (SELECT 1 FROM codes WHERE codes.product_id = products.id);
+
+CREATE TRIGGER codes_prune_product_delete AFTER DELETE ON codes
+    WHEN NOT EXISTS (SELECT 1 FROM codes WHERE product_id = OLD.product_id)
+BEGIN
+    DELETE FROM products WHERE id = OLD.product_id;
+END;
+
+CREATE TRIGGER codes_prune_product_update AFTER UPDATE OF product_id ON codes
+    WHEN NEW.product_id IS NOT OLD.product_id
+    AND NOT EXISTS (SELECT 1 FROM codes WHERE product_id = OLD.product_id)
+BEGIN
+    DELETE FROM products WHERE id = OLD.product_id;
+END;
+'''
+
+# Index i upgrades a database from user_version i to i + 1
+CODES_MIGRATIONS = [NORMALIZE_CODES, TRACK_USED_AT, PRUNE_PRODUCTS]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def file_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def time_queries(conn, repeat=5):
+    timings = {}
+    for name, (query, params) in BENCHMARK_QUERIES.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(query, params).fetchall()
+        timings[name] = round((time.perf_counter() - started) / repeat * 1000, 3)
+    return timings
+
+
+def migrate_codes_database(conn, path=None):
+    version = schema_version(conn)
+    if version >= len(CODES_MIGRATIONS):
+        return None
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS product_codes
+                    (id INTEGER PRIMARY KEY, product_name TEXT, product_code TEXT,
+                     code_type TEXT, used_status TEXT)''')
+    report = {'from_version': version, 'to_version': len(CODES_MIGRATIONS)}
+    if path:
+        report['size_before'] = file_size(path)
+    report['timings_before_ms'] = time_queries(conn)
+
+    conn.commit()
+    for target_version in range(version + 1, len(CODES_MIGRATIONS) + 1):
+        script = CODES_MIGRATIONS[target_version - 1]
+        # executescript commits first, so wrap each step in its own transaction
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {target_version};\nCOMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        logging.info(f"Migrated Codes.db schema to version {target_version}")
+
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    if path:
+        report['size_after'] = file_size(path)
+    report['timings_after_ms'] = time_queries(conn)
+    logging.info(f"Codes.db migration report: {report}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade a Codes.db file to the current schema and report the gain.")
+    parser.add_argument('database', help="path to Codes.db")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    conn = sqlite3.connect(args.database)
+    try:
+        report = migrate_codes_database(conn, args.database)
+    finally:
+        conn.close()
+    if report is None:
+        print(f"{args.database} is already at schema version {len(CODES_MIGRATIONS)}")
+        return
+    print(f"Schema version {report['from_version']} -> {report['to_version']}")
+    print(f"File size: {report['size_before']} -> {report['size_after']} bytes")
+    for name, before in report['timings_before_ms'].items():
+        print(f"{name}: {before} ms -> {report['timings_after_ms'][name]} ms")
+
+
+if __name__ == "__main__":
+    main()
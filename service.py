@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from db_control import DatabaseManager
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+CODE_COLUMNS = ['id', 'product_name', 'product_code', 'code_type', 'used_status']
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class LatencyMetrics:
+    def __init__(self, window=1000):
+        self.window = window
+        self.routes = {}
+
+    def record(self, route, seconds, failed):
+        stats = self.routes.setdefault(route, {'count': 0, 'errors': 0, 'samples': deque(maxlen=self.window)})
+        stats['count'] += 1
+        stats['errors'] += int(failed)
+        stats['samples'].append(seconds)
+
+    def snapshot(self):
+        report = {}
+        for route, stats in self.routes.items():
+            samples = sorted(stats['samples'])
+            report[route] = {
+                'count': stats['count'],
+                'errors': stats['errors'],
+                'p50_ms': self.percentile(samples, 0.50),
+                'p95_ms': self.percentile(samples, 0.95),
+                'p99_ms': self.percentile(samples, 0.99),
+                'max_ms': round(samples[-1] * 1000, 3) if samples else None,
+            }
+        return report
+
+    def percentile(self, samples, fraction):
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * fraction))
+        return round(samples[index] * 1000, 3)
+
+
+class CodeService:
+    def __init__(self, db_manager, workers=4, max_pending=64):
+        self.db_manager = db_manager
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="CodeService")
+        self.max_pending = max_pending
+        self.slots = None
+        self.metrics = LatencyMetrics()
+        self.routes = {
+            ('GET', '/search'): self.search,
+            ('GET', '/lookup'): self.lookup,
+            ('GET', '/complete'): self.complete,
+            ('POST', '/claim'): self.claim,
+            ('POST', '/import'): self.bulk_import,
+            ('GET', '/metrics'): self.report_metrics,
+        }
+
+    async def serve(self, host, port):
+        self.slots = asyncio.Semaphore(self.max_pending)
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f"Code service listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    async def run_blocking(self, function, *args):
+        # Bounded: at most max_pending database calls queued on the executor
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await self.dispatch(method, target, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            await self.write_response(writer, e.status, {'error': e.message}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    async def write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        started = time.perf_counter()
+        handler = self.routes.get((method, path))
+        # Unknown paths share one entry, probes must not grow the metrics without bound
+        route = f"{method} {path}" if handler is not None else 'unmatched'
+        status = 500
+        try:
+            if handler is None:
+                known_path = any(route_path == path for _, route_path in self.routes)
+                raise HttpError(405 if known_path else 404, f"No route for {method} {path}")
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, payload = await handler(query, self.parse_json(body))
+        except HttpError as e:
+            status, payload = e.status, {'error': e.message}
+        except Exception as e:
+            logging.exception(f"Code service failed on {method} {path}")
+            status, payload = 500, {'error': str(e)}
+        finally:
+            self.metrics.record(route, time.perf_counter() - started, status >= 400)
+        return status, payload
+
+    def parse_json(self, body):
+        if not body:
+            return {}
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise HttpError(400, "Body is not valid JSON")
+
+    def to_dict(self, row):
+        return dict(zip(CODE_COLUMNS, row))
+
+    async def search(self, query, body):
+        try:
+            limit = int(query.get('limit', 100))
+        except ValueError:
+            raise HttpError(400, "limit must be an integer")
+        rows = await self.run_blocking(
+            self.db_manager.search_product_codes, query.get('q', ''),
+            query.get('code_type', 'Default'), query.get('status', 'Default'), None, limit)
+        return 200, {'results': [self.to_dict(row) for row in rows]}
+
+    async def lookup(self, query, body):
+        product_code = query.get('code', '')
+        if not product_code:
+            raise HttpError(400, "code is required")
+        row = await self.run_blocking(self.db_manager.find_product_code, product_code)
+        if row is None:
+            raise HttpError(404, f"Product code {product_code} not found")
+        return 200, row
+
+    async def complete(self, query, body):
+        try:
+            limit = int(query.get('limit', 20))
+        except ValueError:
+            raise HttpError(400, "limit must be an integer")
+        # Cheap, but it shares the manager lock with long writes such as /import
+        results = await self.run_blocking(self.db_manager.complete_product_name, query.get('prefix', ''), limit)
+        return 200, {'results': results}
+
+    async def claim(self, query, body):
+        product_name = body.get('product_name') if isinstance(body, dict) else None
+        if not isinstance(product_name, str) or not product_name:
+            raise HttpError(400, "product_name is required")
+        if not isinstance(body.get('code_type'), (str, type(None))):
+            raise HttpError(400, "code_type must be a string")
+        row = await self.run_blocking(self.db_manager.claim_product_code, product_name, body.get('code_type'))
+        if row is None:
+            raise HttpError(404, f"No available code for {product_name}")
+        return 200, row
+
+    async def bulk_import(self, query, body):
+        codes = body.get('codes') if isinstance(body, dict) else None
+        if not isinstance(codes, list) or not all(isinstance(code, dict) for code in codes):
+            raise HttpError(400, "codes must be a list of objects")
+        result = await self.run_blocking(self.db_manager.import_product_codes, codes)
+        return 200, result
+
+    async def report_metrics(self, query, body):
+        return 200, self.metrics.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local JSON service for searching, claiming and importing codes.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-pending', type=int, default=64)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename='service_log.txt', level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    db_manager = DatabaseManager()
+    service = CodeService(db_manager, args.workers, args.max_pending)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
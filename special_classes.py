@@ -1,5 +1,6 @@
-from PyQt5.QtWidgets import QLineEdit, QWidget, QHBoxLayout, QLabel, QPushButton
-from PyQt5.QtCore import Qt, QPoint
+from PyQt5.QtWidgets import QLineEdit, QWidget, QHBoxLayout, QLabel, QPushButton, QCompleter
+from PyQt5.QtCore import Qt, QPoint, QStringListModel, QObject, QEvent, QTimer, pyqtSignal
+import time
 
 
 class EnterLineEdit(QLineEdit):
@@ -10,6 +11,55 @@ class EnterLineEdit(QLineEdit):
             super().keyPressEvent(event)
 
 
+class PrefixCompleter(QCompleter):
+    def __init__(self, complete_function, line_edit, limit=20):
+        super().__init__(line_edit)
+        self.complete_function = complete_function
+        self.limit = limit
+        self.string_model = QStringListModel(self)
+        self.setModel(self.string_model)
+        self.setCaseSensitivity(Qt.CaseInsensitive)
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        line_edit.setCompleter(self)
+        line_edit.textEdited.connect(self.updateCompletions)
+
+    def updateCompletions(self, text):
+        # Only the current matches go into the model, so the popup never filters a big list
+        self.string_model.setStringList(self.complete_function(text, self.limit) if text else [])
+        if self.string_model.rowCount():
+            self.complete()
+        else:
+            self.popup().hide()
+
+
+class IdleWatcher(QObject):
+    idle = pyqtSignal()
+
+    input_events = (QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.MouseMove, QEvent.Wheel)
+
+    def __init__(self, app, idle_seconds, repeat_seconds):
+        super().__init__(app)
+        self.idle_seconds = idle_seconds
+        self.repeat_seconds = repeat_seconds
+        self.last_input = time.monotonic()
+        self.last_idle = 0.0
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.checkIdle)
+        self.timer.start(max(1, min(idle_seconds, 30)) * 1000)
+        app.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() in self.input_events:
+            self.last_input = time.monotonic()
+        return False
+
+    def checkIdle(self):
+        now = time.monotonic()
+        if now - self.last_input >= self.idle_seconds and now - self.last_idle >= self.repeat_seconds:
+            self.last_idle = now
+            self.idle.emit()
+
+
 class CustomTitleBar(QWidget):
     def __init__(self, parent=None, title_bar_height=30, button_width=30):
         super().__init__(parent)
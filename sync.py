@@ -0,0 +1,307 @@
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import uuid
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+CODE_COLUMNS = ['product_name', 'code_type', 'used_status']
+ARCHIVE_FILE = 'CodesArchive.db'
+
+
+def initialize_change_log(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sync_meta
+                      (key TEXT PRIMARY KEY, value TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sync_state
+                      (origin TEXT PRIMARY KEY, last_seq INTEGER NOT NULL)''')
+    # What each peer had seen the last time we exchanged changes with it
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sync_peers
+                      (peer TEXT NOT NULL, origin TEXT NOT NULL, last_seq INTEGER NOT NULL,
+                       PRIMARY KEY (peer, origin))''')
+    created = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'").fetchone() is None
+    cursor.execute('''CREATE TABLE IF NOT EXISTS change_log
+                      (seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, origin_seq INTEGER NOT NULL,
+                       changed_at TEXT NOT NULL, action TEXT NOT NULL, product_code TEXT NOT NULL,
+                       product_name TEXT, code_type TEXT, used_status TEXT)''')
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_change_log_origin
+                      ON change_log (origin, origin_seq)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_change_log_product_code
+                      ON change_log (product_code, changed_at, origin, origin_seq)''')
+    origin = get_origin_id(conn)
+
+    # Existing rows predate the log, record them once so peers can pick them up
+    has_codes = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'product_codes'").fetchone() is not None
+    if created and has_codes:
+        rows = cursor.execute("SELECT product_code, product_name, code_type, used_status FROM product_codes")
+        for row in rows.fetchall():
+            record_change(conn, origin, UPSERT, dict(zip(['product_code'] + CODE_COLUMNS, row)))
+    conn.commit()
+    return origin
+
+
+def get_origin_id(conn):
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = 'origin'").fetchone()
+    if row:
+        return row[0]
+    origin = uuid.uuid4().hex
+    conn.execute("INSERT INTO sync_meta (key, value) VALUES ('origin', ?)", (origin,))
+    return origin
+
+
+def record_change(conn, origin, action, row):
+    cursor = conn.execute(
+        "SELECT last_seq FROM sync_state WHERE origin = ?", (origin,))
+    last = cursor.fetchone()
+    entry = {
+        'origin': origin,
+        'origin_seq': (last[0] if last else 0) + 1,
+        'changed_at': datetime.now(timezone.utc).isoformat(timespec='microseconds'),
+        'action': action,
+        'product_code': row['product_code'],
+    }
+    for column in CODE_COLUMNS:
+        entry[column] = row.get(column) if action == UPSERT else None
+    append_entry(conn, entry)
+
+
+def append_entry(conn, entry):
+    columns = ', '.join(entry.keys())
+    placeholders = ', '.join(['?' for _ in entry])
+    conn.execute(f"INSERT INTO change_log ({columns}) VALUES ({placeholders})", list(entry.values()))
+    conn.execute('''INSERT INTO sync_state (origin, last_seq) VALUES (?, ?)
+                    ON CONFLICT(origin) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)''',
+                 (entry['origin'], entry['origin_seq']))
+
+
+def is_newer(entry, latest):
+    if latest is None:
+        return True
+    return (entry['changed_at'], entry['origin'], entry['origin_seq']) > tuple(latest)
+
+
+def has_archive(conn):
+    return any(row[1] == 'archive' for row in conn.execute("PRAGMA database_list"))
+
+
+def apply_archived_entry(conn, entry):
+    # Archiving is not logged, so a code this desk archived is still known to peers;
+    # their changes land on the archived row instead of reviving it in product_codes
+    archived = conn.execute("SELECT 1 FROM archive.archived_codes WHERE product_code = ? LIMIT 1",
+                            (entry['product_code'],)).fetchone()
+    if not archived:
+        return False
+    if entry['action'] == DELETE:
+        conn.execute("DELETE FROM archive.archived_codes WHERE product_code = ?", (entry['product_code'],))
+    else:
+        set_clause = ', '.join(f"{column} = ?" for column in CODE_COLUMNS)
+        conn.execute(f"UPDATE archive.archived_codes SET {set_clause} WHERE product_code = ?",
+                     [entry[column] for column in CODE_COLUMNS] + [entry['product_code']])
+    return True
+
+
+def apply_entry(conn, entry):
+    latest = conn.execute('''SELECT changed_at, origin, origin_seq FROM change_log
+                             WHERE product_code = ?
+                             ORDER BY changed_at DESC, origin DESC, origin_seq DESC LIMIT 1''',
+                          (entry['product_code'],)).fetchone()
+    if not is_newer(entry, latest):
+        logging.info(f"Sync conflict on {entry['product_code']}: keeping local change")
+        return False
+
+    if has_archive(conn) and apply_archived_entry(conn, entry):
+        return True
+
+    if entry['action'] == DELETE:
+        conn.execute("DELETE FROM product_codes WHERE product_code = ?", (entry['product_code'],))
+        return True
+
+    values = [entry[column] for column in CODE_COLUMNS]
+    exists = conn.execute(
+        "SELECT 1 FROM product_codes WHERE product_code = ? LIMIT 1", (entry['product_code'],)).fetchone()
+    if exists:
+        set_clause = ', '.join(f"{column} = ?" for column in CODE_COLUMNS)
+        conn.execute(f"UPDATE product_codes SET {set_clause} WHERE product_code = ?",
+                     values + [entry['product_code']])
+    else:
+        conn.execute(f"INSERT INTO product_codes (product_code, {', '.join(CODE_COLUMNS)}) VALUES (?, ?, ?, ?)",
+                     [entry['product_code']] + values)
+    return True
+
+
+def transfer(source, target, apply=True):
+    target_origin = get_origin_id(target)
+    marks = dict(target.execute("SELECT origin, last_seq FROM sync_state").fetchall())
+    transferred = 0
+    applied = 0
+
+    with target:
+        for origin, last_seq in source.execute("SELECT origin, last_seq FROM sync_state").fetchall():
+            since = marks.get(origin, 0)
+            # The target is the authority on its own changes
+            if origin == target_origin or last_seq <= since:
+                continue
+            cursor = source.execute('''SELECT origin, origin_seq, changed_at, action, product_code,
+                                              product_name, code_type, used_status
+                                       FROM change_log WHERE origin = ? AND origin_seq > ?
+                                       ORDER BY origin_seq''', (origin, since))
+            columns = [column[0] for column in cursor.description]
+            for row in cursor:
+                entry = dict(zip(columns, row))
+                if apply and apply_entry(target, entry):
+                    applied += 1
+                append_entry(target, entry)
+                transferred += 1
+    return transferred, applied
+
+
+def sync_marks(conn):
+    return conn.execute("SELECT origin, last_seq FROM sync_state").fetchall()
+
+
+def record_peer_state(conn, peer, marks):
+    with conn:
+        conn.execute("DELETE FROM sync_peers WHERE peer = ?", (peer,))
+        conn.executemany("INSERT INTO sync_peers (peer, origin, last_seq) VALUES (?, ?, ?)",
+                         [(peer, origin, last_seq) for origin, last_seq in marks])
+
+
+def prune_change_log(conn, first_seq=None, last_seq=None):
+    # An entry goes once every known peer has it and it no longer decides a conflict:
+    # either a newer entry for the same code exists, or it is a delete and at least
+    # one peer has been told. The latest upsert of every code always stays, so a new
+    # peer still receives the full current state. A seq range bounds the work per call.
+    seq_range = ''
+    parameters = [DELETE]
+    if first_seq is not None and last_seq is not None:
+        seq_range = 'c.seq BETWEEN ? AND ? AND'
+        parameters = [first_seq, last_seq, DELETE]
+    with conn:
+        cursor = conn.execute(f'''
+            DELETE FROM change_log WHERE seq IN (
+                SELECT c.seq FROM change_log c
+                WHERE {seq_range} NOT EXISTS (
+                    SELECT 1 FROM (SELECT DISTINCT peer FROM sync_peers) p
+                    LEFT JOIN sync_peers s ON s.peer = p.peer AND s.origin = c.origin
+                    WHERE coalesce(s.last_seq, 0) < c.origin_seq)
+                AND (EXISTS (
+                        SELECT 1 FROM change_log n
+                        WHERE n.product_code = c.product_code
+                        AND (n.changed_at, n.origin, n.origin_seq) > (c.changed_at, c.origin, c.origin_seq))
+                    OR (c.action = ? AND EXISTS (SELECT 1 FROM sync_peers))))''', parameters)
+    if cursor.rowcount:
+        logging.info(f"Pruned {cursor.rowcount} change log entries every peer has seen")
+    return cursor.rowcount
+
+
+def read_archive_file(settings_file='settings.xml'):
+    # Same role registry as DatabaseManager, a desk may give its archive another name
+    try:
+        root = ET.parse(settings_file).getroot()
+    except (FileNotFoundError, ET.ParseError):
+        return ARCHIVE_FILE
+    for element in root.findall('database/files/file'):
+        if element.get('role') == 'archive' and (element.text or '').strip():
+            return element.text.strip()
+    return ARCHIVE_FILE
+
+
+def archive_path_for(db_path):
+    path = os.path.join(os.path.dirname(os.path.abspath(db_path)), read_archive_file())
+    return path if os.path.exists(path) else None
+
+
+def open_database(path, archive_path=None):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS product_codes
+                    (id INTEGER PRIMARY KEY, product_name TEXT, product_code TEXT,
+                     code_type TEXT, used_status TEXT)''')
+    initialize_change_log(conn)
+    if archive_path:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        if conn.execute("SELECT 1 FROM archive.sqlite_master WHERE name = 'archived_codes'").fetchone() is None:
+            conn.execute("DETACH DATABASE archive")
+    return conn
+
+
+def sync_databases(path_a, path_b, archive_a=None, archive_b=None):
+    conn_a = open_database(path_a, archive_a or archive_path_for(path_a))
+    conn_b = open_database(path_b, archive_b or archive_path_for(path_b))
+    try:
+        received = transfer(conn_b, conn_a)
+        sent = transfer(conn_a, conn_b)
+        record_peer_state(conn_a, get_origin_id(conn_b), sync_marks(conn_b))
+        record_peer_state(conn_b, get_origin_id(conn_a), sync_marks(conn_a))
+        prune_change_log(conn_a)
+        prune_change_log(conn_b)
+    finally:
+        conn_a.close()
+        conn_b.close()
+    logging.info(f"Synced {path_a} with {path_b}: received {received[0]} changes ({received[1]} applied), "
+                 f"sent {sent[0]} changes ({sent[1]} applied)")
+    return received, sent
+
+
+def sync_folder(db_path, folder, archive_path=None):
+    os.makedirs(folder, exist_ok=True)
+    conn = open_database(db_path, archive_path or archive_path_for(db_path))
+    received = [0, 0]
+    try:
+        own_drop = os.path.join(folder, f"{get_origin_id(conn)}.changes.db")
+        for drop_path in sorted(glob.glob(os.path.join(glob.escape(folder), '*.changes.db'))):
+            if os.path.abspath(drop_path) == os.path.abspath(own_drop):
+                continue
+            drop = sqlite3.connect(drop_path)
+            try:
+                initialize_change_log(drop)
+                # A drop file carries everything its desk knew when it was published
+                peer_marks = sync_marks(drop)
+                transferred, applied = transfer(drop, conn)
+                record_peer_state(conn, get_origin_id(drop), peer_marks)
+            finally:
+                drop.close()
+            received[0] += transferred
+            received[1] += applied
+
+        # Our drop file carries only the log, everything we know goes out
+        drop = sqlite3.connect(own_drop)
+        try:
+            initialize_change_log(drop)
+            sent = transfer(conn, drop, apply=False)
+            prune_change_log(drop)
+        finally:
+            drop.close()
+        prune_change_log(conn)
+    finally:
+        conn.close()
+    logging.info(f"Synced {db_path} through {folder}: received {received[0]} changes ({received[1]} applied), "
+                 f"published {sent[0]} changes")
+    return tuple(received), sent
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Exchange product code changes between Codes.db files. Run while the app is closed.")
+    parser.add_argument('database', help="local Codes.db")
+    parser.add_argument('peer', nargs='?', help="another Codes.db to sync with directly")
+    parser.add_argument('--folder', help="shared folder to exchange change files through")
+    parser.add_argument('--archive', help="local archive database, defaults to the archive file from settings.xml next to the database")
+    args = parser.parse_args()
+    if bool(args.peer) == bool(args.folder):
+        parser.error("give either a peer database or --folder")
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.folder:
+        sync_folder(args.database, args.folder, args.archive)
+    else:
+        sync_databases(args.database, args.peer, args.archive)
+
+
+if __name__ == "__main__":
+    main()